@@ -7,7 +7,13 @@
 # =============================================================================
 
 import streamlit as st
+import functools
+import logging
 import math
+import threading
+import time
+from io import BytesIO
+import matplotlib.pyplot as plt
 import pydeck as pdk
 import pandas as pd
 from bokeh.models import ColumnDataSource, FactorRange, BasicTickFormatter
@@ -37,59 +43,211 @@ petitions_2_column = {'Solicitudes': 'total_applied',
 column_2_petitions = {name_column: spanish for spanish, name_column in
                       petitions_2_column.items()}
 
+# Diccionario de las opciones a elegir como clave y los valores de la columna
+# 'continent_origin_country'.
+continent_2_category = {'Africa': 'Africa',
+                        'América del Norte': 'Northern America',
+                        'Apátrida': 'Stateless',
+                        'Asia': 'Asia',
+                        'Desconocido': 'Unknown',
+                        'Europa': 'Europe',
+                        'Latinoamérica y el Caribe':
+                            'Latin America and the Caribbean',
+                        'Oceania': 'Oceania',
+                        'Todos':  'Todos'}
+
+datasets_2_path = {'population': './data/processed/acnur_data_population.csv',
+                   'asylum_petitions': './data/processed/acnur_data_asylum_petitions.csv',
+                   'countries': './data/processed/acnur_countries.csv',
+                   'demographics': './data/processed/acnur_data_demographics.csv'}
+
+# Valores por defecto de los widgets de cada página. Se comparten entre el
+# dashboard y el precalentamiento para que ambos calculen exactamente lo mismo.
+MOVEMENT_FIRST_YEAR = 1970
+MOVEMENT_YEAR_INDEX = 18
+COUNTRY_YEARS = range(1951, 2023)
+COUNTRY_YEAR_INDEX = 70
+COUNTRY_CONTINENT_INDEX = 2
+COUNTRY_EXCLUDED_CONTINENTS = ['Apátrida', 'Desconocido', 'Todos']
+GENERAL_POPULATION_INDEX = 3
+GENERAL_CONTINENT_INDEX = 0
+PETITIONS_DEFAULT = ['Solicitudes']
+PETITIONS_ORIGIN_INDEX = 0
+PETITIONS_ASYLUM_INDEX = 0
+PETITIONS_ASYLUM_EXCLUDED_CONTINENTS = ['Apátrida', 'Desconocido']
+
+# Tipos de población que se grafican en la página de cada país según si se
+# consultan los refugiados recibidos o enviados.
+situation_2_columns = {'Recibidos': ['refugees', 'asylum_seekers',
+                                     'other_concern', 'other_need'],
+                       'Enviados': ['refugees', 'asylum_seekers', 'other_concern',
+                                    'internally_displaced', 'other_need',
+                                    'returned_internally_displaced']}
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Sets de datos y estructuras derivadas (cacheadas entre sesiones).
+#
+# En Streamlit 1.17, experimental_memo y experimental_singleton no guardan nada
+# cuando se llaman fuera de una sesión, así que el hilo de precalentamiento no
+# podría llenarlos. Por eso las cachés son de proceso (functools.lru_cache):
+# las comparten todas las sesiones y el propio hilo.
+#
+# Los sets de datos completos y los mapas se devuelven sin copiar, y quien los
+# use solo puede leerlos. Las agregaciones, que los gráficos modifican, se
+# devuelven copiadas. Todas las cachés por selección del usuario tienen un
+# tamaño máximo para que el proceso no crezca sin límite.
+# =============================================================================
+def shared_cache(maxsize=None, copy=False):
+    def decorator(func):
+        cached = functools.lru_cache(maxsize=maxsize)(func)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            # Las listas (p. ej. las columnas del multiselect) no son hashables.
+            args = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+            result = cached(*args)
+            if copy:
+                result = tuple(r.copy() for r in result)\
+                    if isinstance(result, tuple) else result.copy()
+            return result
+
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+
+    return decorator
+
+
+@shared_cache()
+def load_dataset(name):
+    return pd.read_csv(datasets_2_path[name])
+
+
+@shared_cache()
+def movement_data():
+    population = load_dataset('population')
+    df_map_1 = population[['year', 'name_origin_country', 'name_asylum_country',
+                           'continent_origin_country', 'longitude_origin_country',
+                           'latitude_origin_country', 'longitude_asylum_country',
+                           'latitude_asylum_country']]
+
+    df_map_1 = df_map_1.dropna()
+
+    df_map_1 = df_map_1.loc[(df_map_1.name_origin_country != 'Unknown') |
+                            df_map_1.name_asylum_country != 'Unknown']
+
+    return df_map_1
+
+
+@shared_cache(maxsize=16, copy=True)
+def population_by_year(continent_name):
+    population = load_dataset('population')
+
+    # Filtrado del set de datos por continente elegido y agrupando por año.
+    if continent_name != 'Todos':
+        population = population.loc[population.continent_origin_country ==
+                                    continent_name]
+
+    return population.groupby(['year'], as_index=False).sum()
+
+
+@shared_cache(maxsize=64, copy=True)
+def petitions_by_year(origin_continent, asylum_continent, columns_names):
+    asylum_petitions = load_dataset('asylum_petitions')
+
+    # Filtrado del set de datos por continente de origen elegido.
+    if origin_continent != 'Todos':
+        df_graph_2 = asylum_petitions.loc[asylum_petitions.continent_origin_country ==
+                                          origin_continent].groupby(['year',
+                                                                     'continent_asylum_country'],
+                                                                    as_index=False).sum()
+    else:
+        df_graph_2 = asylum_petitions.groupby(['year',
+                                               'continent_asylum_country'],
+                                              as_index=False).sum()
+
+    # Filtrado del set de datos por continente de asilo elegido.
+    if asylum_continent != 'Todos':
+        df_graph_2 = df_graph_2.loc[df_graph_2.continent_asylum_country ==
+                                    asylum_continent].groupby(['year'],
+                                                              as_index=False).sum()
+
+    # Filtrado del set de datos por selección de columnas.
+    return df_graph_2.loc[:, list(columns_names) +
+                          ['year']].groupby(['year'], as_index=False).sum()
+
+
+@shared_cache(maxsize=32, copy=True)
+def country_data(country, year, situation):
+    population = load_dataset('population')
+    demographics = load_dataset('demographics')
+
+    # Los refugiados recibidos se buscan por país de asilo y se ubican en el
+    # mapa por su país de origen; los enviados, al revés.
+    if situation == 'Recibidos':
+        filter_column, map_location = 'name_asylum_country', 'origin'
+    else:
+        filter_column, map_location = 'name_origin_country', 'asylum'
+
+    df_country = population.loc[(population[filter_column] == country) &
+                                (population.year == year)].groupby(['year'],
+                                                                   as_index=False).sum()
+
+    df_country_sex = demographics.loc[(demographics[filter_column] == country) &
+                                      (demographics.year == year)].groupby(['year'],
+                                                                           as_index=False).sum()
+
+    df_map_3 = population.loc[(population[filter_column] == country) &
+                              (population.year == year)]
+    df_map_3 = df_map_3[[f'longitude_{map_location}_country',
+                         f'latitude_{map_location}_country']]
+    df_map_3 = df_map_3.dropna()
+    df_map_3 = df_map_3.rename(columns={f'longitude_{map_location}_country': 'longitude',
+                                        f'latitude_{map_location}_country': 'latitude'})
+
+    return df_country, df_country_sex, df_map_3
+
+
+@shared_cache(maxsize=32, copy=True)
+def population_by_type(country, year, situation):
+    df_country = country_data(country, year, situation)[0]
+
+    # Para poder graficar los tipos de población convierto las columnas en filas.
+    df_graph_3 = pd.melt(df_country, id_vars='year',
+                         value_vars=situation_2_columns[situation])
+
+    return df_graph_3.loc[(df_graph_3.value != 0)]
+
+
+def continent_options(exclude_continents=[]):
+    return [c for c in continent_2_category if c not in exclude_continents]
 
-def continent_selectbox(exclude_continents=[], value=1, suffix='', index=0):
-    all_continents = ['Africa', 'América del Norte', 'Apátrida', 'Asia',
-                      'Desconocido', 'Europa', 'Latinoamérica y el Caribe',
-                      'Oceania', 'Todos']
 
-    continents_2_show = [c for c in all_continents if c not in
-                         exclude_continents]
+def continent_selectbox(exclude_continents=[], value=1, suffix='', index=0):
+    continents_2_show = continent_options(exclude_continents)
 
     selectbox_name = '**Continente**' if not suffix else f'**Continente {suffix}**'
 
     continent = st.selectbox(selectbox_name, continents_2_show, key=value, index=index)
 
-    # Diccionario de las opciones a elegir como clave y los valores de la columna
-    # 'continent_origin_country'.
-    continent_2_category = {'Africa': 'Africa',
-                            'América del Norte': 'Northern America',
-                            'Apátrida': 'Stateless',
-                            'Asia': 'Asia',
-                            'Desconocido': 'Unknown',
-                            'Europa': 'Europe',
-                            'Latinoamérica y el Caribe':
-                                'Latin America and the Caribbean',
-                            'Oceania': 'Oceania',
-                            'Todos':  'Todos'}
-
     return continent_2_category[continent]
 
 
-def map_movement_year(df_map_1):
-    # Slider widget para filtrar por año
-    year = st.selectbox(
-        '**Selecciona un año**',
-        range(1970, max(df_map_1['year'])), index=18)
+@shared_cache()
+def movement_years():
+    return range(MOVEMENT_FIRST_YEAR, max(movement_data()['year']))
+
 
+@shared_cache(maxsize=16)
+def movement_deck(year, continent_origin=None):
     # Filtro el set de datos por el año elegido.
+    df_map_1 = movement_data()
     df_map_1 = df_map_1.loc[(df_map_1.year == year)]
 
-    # A partir de 1995 el flujo de refugiados mundial aumenta de forma exponencial y la
-    # visualización se torna inentendible. Es por eso que he decidido agregar la opción de
-    # filtrar por continente cuando el usuario quiera consultar más alla del año 1995.
-    if year > 1995:
-        st.markdown(
-            """
-            **Debido al aumento del flujo de refugiados mundial, elige un
-            continente para una mejor visualización.**
-            """
-        )
-
-        continent_origin = continent_selectbox(['Apátrida',
-                                                'Desconocido',
-                                                'Todos'])
-
+    if continent_origin is not None:
         df_map_1 = df_map_1.loc[df_map_1.continent_origin_country ==
                                 continent_origin]
 
@@ -108,22 +266,39 @@ def map_movement_year(df_map_1):
 
     view_state = pdk.ViewState(latitude=0, longitude=0, zoom=1,)
 
-    st.pydeck_chart(pdk.Deck(arc_layer, initial_view_state=view_state))
+    return pdk.Deck(arc_layer, initial_view_state=view_state)
+
+
+def map_movement_year():
+    # Slider widget para filtrar por año
+    year = st.selectbox(
+        '**Selecciona un año**',
+        movement_years(), index=MOVEMENT_YEAR_INDEX)
+
+    continent_origin = None
+
+    # A partir de 1995 el flujo de refugiados mundial aumenta de forma exponencial y la
+    # visualización se torna inentendible. Es por eso que he decidido agregar la opción de
+    # filtrar por continente cuando el usuario quiera consultar más alla del año 1995.
+    if year > 1995:
+        st.markdown(
+            """
+            **Debido al aumento del flujo de refugiados mundial, elige un
+            continente para una mejor visualización.**
+            """
+        )
+
+        continent_origin = continent_selectbox(['Apátrida',
+                                                'Desconocido',
+                                                'Todos'])
+
+    st.pydeck_chart(movement_deck(year, continent_origin))
 # Fuente: https://pydeck.gl/gallery/arc_layer.html
 
 
-def population_selectbox():
+def population_selectbox(index=GENERAL_POPULATION_INDEX):
     option_type_refugee = st.selectbox('**Tipo de población**',
-                                       ('Apátridas',
-                                        'Desplazados internos',
-                                        'Desplazados internos retornados',
-                                        'Refugiados',
-                                        'Refugiados retornados',
-                                        'Solicitantes de asilo',
-                                        'Venezolanos desplazados',
-                                        'Otras poblaciones',
-                                        'Todas'),
-                                       index=3)
+                                       list(poptype_2_column), index=index)
 
     return poptype_2_column[option_type_refugee], option_type_refugee
 
@@ -193,13 +368,13 @@ def petition_multiselect():
                                       'Status de refugiado reconocido',
                                       'Otro status reconocido',
                                       'Status de refugiado rechazado',
-                                      'Caso cerrado'), default='Solicitudes')
+                                      'Caso cerrado'), default=PETITIONS_DEFAULT)
 
     selection = [petitions_2_column[o] for o in option_petition]
     return selection
 
 
-def plot_petitions_time(df_graph_2, columns_names):
+def petitions_figure(df_graph_2, columns_names):
     # Para poder realizar este gráfico tengo que convertir las columnas en filas.
     df_graph_2 = pd.melt(df_graph_2, id_vars='year',
                          value_vars=columns_names).sort_values(['year',
@@ -258,7 +433,11 @@ def plot_petitions_time(df_graph_2, columns_names):
     graph_2.yaxis.major_label_text_color = '#9396a5'
     graph_2.yaxis.formatter = BasicTickFormatter(use_scientific=False)
 
-    st.bokeh_chart(graph_2)
+    return graph_2
+
+
+def plot_petitions_time(df_graph_2, columns_names):
+    st.bokeh_chart(petitions_figure(df_graph_2, columns_names))
 # Fuente: https://docs.bokeh.org/en/latest/docs/examples/basic/bars/nested_colormapped.html
 
 
@@ -270,7 +449,7 @@ def country_selectbox(df, continent_election, variable):
     return country
 
 
-def plot_population(df_graph_3):
+def population_figure(df_graph_3):
     df_graph_3['variable'] = df_graph_3['variable'].apply(lambda x: column_2_poptype[x])
 
     max_value = max(df_graph_3['value'])
@@ -312,10 +491,27 @@ def plot_population(df_graph_3):
                 axis_ticks=element_line(color='#9396a5'),
                 legend_position='none')
 
-    st.pyplot(ggplot.draw(graph_3))
+    return graph_3
+
 
+@shared_cache(maxsize=32)
+def population_chart(country, year, situation):
+    # Guardo el gráfico ya dibujado como PNG (con los mismos parámetros que usa
+    # st.pyplot) para no volver a dibujarlo con plotnine en cada visita.
+    fig = ggplot.draw(population_figure(population_by_type(country, year, situation)))
+    image = BytesIO()
+    fig.savefig(image, format='png', bbox_inches='tight', dpi=200)
+    plt.close(fig)
 
-def map_refugee(df_map_3):
+    return image.getvalue()
+
+
+def plot_population(country, year, situation):
+    st.image(population_chart(country, year, situation), use_column_width=True)
+
+
+@shared_cache(maxsize=8)
+def refugee_deck(country, year, situation):
     icon_url = 'https://upload.wikimedia.org/wikipedia/commons/thumb/5/59/Yara_Said_refugee_flag.svg/640px-Yara_Said_refugee_flag.svg.png'
     icon_data = {
         "url": icon_url,
@@ -323,7 +519,7 @@ def map_refugee(df_map_3):
         "height": 100,
     }
 
-    data = df_map_3
+    data = country_data(country, year, situation)[2]
     data["icon_data"] = None
     for i in data.index:
         data["icon_data"][i] = icon_data
@@ -339,5 +535,147 @@ def map_refugee(df_map_3):
     )
 
     view_state = pdk.ViewState(latitude=0, longitude=0, zoom=1.7,)
-    st.pydeck_chart(pdk.Deck(icon_layer, initial_view_state=view_state, map_style='light'))
+    return pdk.Deck(icon_layer, initial_view_state=view_state, map_style='light')
+
+
+def map_refugee(country, year, situation):
+    st.pydeck_chart(refugee_deck(country, year, situation))
 # Fuente: https://pydeck.gl/gallery/icon_layer.html
+
+
+# =============================================================================
+# Precalentamiento de cachés.
+#
+# Tras un despliegue o reinicio, el primer usuario pagaría la carga de los CSV,
+# las agregaciones y la construcción de los gráficos por defecto. La primera
+# visita lanza, una sola vez por proceso, un hilo que carga los sets de datos y
+# después prepara la vista por defecto de cada página en paralelo. Cada página
+# espera solo al paso que necesita.
+#
+# Los mapas de pydeck y el gráfico de plotnine quedan en las cachés de proceso
+# ya construidos. El gráfico de Bokeh no se cachea, porque sus modelos no
+# pueden compartirse entre sesiones: de esa página solo se precalculan los
+# datos.
+# =============================================================================
+def warm_datasets():
+    for name in datasets_2_path:
+        load_dataset(name)
+
+
+def warm_movement():
+    # Vista por defecto de 'Problemática': año preseleccionado y, si supera
+    # 1995, el primer continente del selector.
+    year = movement_years()[MOVEMENT_YEAR_INDEX]
+    movement_deck(year, None if year <= 1995 else continent_2_category['Africa'])
+
+
+def warm_general():
+    # Vista por defecto de 'Situación general'. El tipo de población
+    # (GENERAL_POPULATION_INDEX) se filtra después de la agregación cacheada,
+    # por lo que la clave depende solo del continente.
+    continent_name = continent_2_category[
+        continent_options()[GENERAL_CONTINENT_INDEX]]
+    population_by_year(continent_name)
+
+    origin_continent = continent_2_category[
+        continent_options()[PETITIONS_ORIGIN_INDEX]]
+    asylum_continent = continent_2_category[
+        continent_options(PETITIONS_ASYLUM_EXCLUDED_CONTINENTS)[PETITIONS_ASYLUM_INDEX]]
+    columns_names = [petitions_2_column[p] for p in PETITIONS_DEFAULT]
+    petitions_by_year(origin_continent, asylum_continent, columns_names)
+
+
+def warm_country():
+    # Vista por defecto de 'Situación por país': primer país del continente
+    # preseleccionado, año por defecto y refugiados recibidos.
+    countries = load_dataset('countries')
+    continent_election = continent_2_category[
+        continent_options(COUNTRY_EXCLUDED_CONTINENTS)[COUNTRY_CONTINENT_INDEX]]
+    country = countries.loc[countries.continent == continent_election, 'name'].iloc[0]
+    year = COUNTRY_YEARS[COUNTRY_YEAR_INDEX]
+
+    if not population_by_type(country, year, 'Recibidos').empty:
+        population_chart(country, year, 'Recibidos')
+        refugee_deck(country, year, 'Recibidos')
+
+
+class Warmup:
+    def __init__(self, datasets_step, page_steps):
+        # Cada paso es una tupla (descripción, función) y las páginas se
+        # identifican por nombre.
+        self.steps = {'datasets': datasets_step} | page_steps
+        self.done = {name: threading.Event() for name in self.steps}
+        self.errors = {}
+
+    def progress(self, names):
+        return sum(self.done[n].is_set() for n in names) / len(names)
+
+    def pending(self, names):
+        return [self.steps[n][0] for n in names if not self.done[n].is_set()]
+
+    def run_step(self, name):
+        description, step = self.steps[name]
+        logger.info('Precalentamiento: %s', description)
+        try:
+            step()
+        except Exception as e:
+            # Si falla, la página se sirve igualmente calculando en frío.
+            self.errors[name] = e
+            logger.exception('Precalentamiento interrumpido en: %s', description)
+        finally:
+            self.done[name].set()
+
+    def run(self):
+        # Los sets de datos los necesitan todas las páginas; después cada
+        # página se prepara en su propio hilo para no esperar a las demás.
+        self.run_step('datasets')
+        for name in self.steps:
+            if name != 'datasets':
+                threading.Thread(target=self.run_step, args=(name,),
+                                 name=f'acnur-warmup-{name}', daemon=True).start()
+
+
+# Un único precalentamiento por proceso. El lock evita que varias sesiones
+# que llegan a la vez tras un despliegue lancen cada una el suyo.
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def start_warmup():
+    global _warmup
+
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup(('Cargando sets de datos', warm_datasets),
+                             {'movement': ('Preparando el mapa de movimientos',
+                                           warm_movement),
+                              'general': ('Preparando la situación general',
+                                          warm_general),
+                              'country': ('Preparando la situación por país',
+                                          warm_country)})
+
+            threading.Thread(target=_warmup.run, name='acnur-warmup',
+                             daemon=True).start()
+
+    return _warmup
+
+
+def wait_for_warmup(*steps):
+    warmup = start_warmup()
+    steps = ('datasets',) + steps
+    if not warmup.pending(steps):
+        return warmup
+
+    placeholder = st.empty()
+    with placeholder.container():
+        st.info('Preparando el tablero, esto solo ocurre tras un reinicio...')
+        progress_bar = st.progress(warmup.progress(steps))
+        step_text = st.caption(', '.join(warmup.pending(steps)))
+
+    while warmup.pending(steps):
+        time.sleep(0.25)
+        progress_bar.progress(warmup.progress(steps))
+        step_text.caption(', '.join(warmup.pending(steps)))
+
+    placeholder.empty()
+    return warmup
@@ -7,25 +7,19 @@
 # =============================================================================
 
 import streamlit as st
-import pandas as pd
 import app_functions as af
 from streamlit_option_menu import option_menu
 
 
-# =============================================================================
-# Sets de Datos
-# =============================================================================
-population = pd.read_csv('./data/processed/acnur_data_population.csv')
-asylum_petitions = pd.read_csv('./data/processed/acnur_data_asylum_petitions.csv')
-countries = pd.read_csv('./data/processed/acnur_countries.csv')
-demographics = pd.read_csv('./data/processed/acnur_data_demographics.csv')
-
-
 # =============================================================================
 # Página.
 # =============================================================================
 st.set_page_config(layout="wide", page_title='Refugiados')
 
+# La primera visita tras un reinicio lanza el precalentamiento de los datos y
+# de las vistas por defecto. Cada apartado espera solo a la parte que necesita.
+af.start_warmup()
+
 # =============================================================================
 # Menú lateral
 # =============================================================================
@@ -80,21 +74,10 @@ if selected == 'Problemática':
     st.markdown('---')
 
     # Mapa: Movimiento por años.
-    # Definición del set de datos.
-    df_map_1 = population[['year', 'name_origin_country', 'name_asylum_country',
-                           'continent_origin_country', 'longitude_origin_country',
-                           'latitude_origin_country', 'longitude_asylum_country',
-                           'latitude_asylum_country']]
+    af.wait_for_warmup('movement')
 
-    df_map_1 = df_map_1.dropna()
-
-    df_map_1 = df_map_1.loc[(df_map_1.name_origin_country != 'Unknown') |
-                            df_map_1.name_asylum_country != 'Unknown']
-
-    df_map = df_map_1.loc[(df_map_1.name_origin_country !=
-                           df_map_1.name_asylum_country)]
     # Llamo a la función correspondiente para dibujar el mapa.
-    af.map_movement_year(df_map_1)
+    af.map_movement_year()
     st.caption('Fuente: Elaboración propia con datos extraídos de ACNUR.')
 
 # ==============================
@@ -102,6 +85,7 @@ if selected == 'Problemática':
 # ==============================
 elif selected == 'Situación general':
     st.header('Situación general de los refugiados')
+    af.wait_for_warmup('general')
 
     # Subtítulo 1: Evolución a lo largo del tiempo
     st.subheader('Evolución de los flujos de poblacionales a lo largo del tiempo')
@@ -113,17 +97,11 @@ elif selected == 'Situación general':
 
     # Para filtrar por continente
     with row2_2:
-        continent_name = af.continent_selectbox()
-
-    # Filtrado del set de datos por continente elegido.
-    if continent_name != 'Todos':
-        # Definición del set de datos filtrando por continente elegido y agru-
-        # pando por año.
-        df_graph_1 = population.loc[population.continent_origin_country ==
-                                    continent_name].groupby(
-                                        ['year'], as_index=False).sum()
-    else:
-        df_graph_1 = population.groupby(['year'], as_index=False).sum()
+        continent_name = af.continent_selectbox(index=af.GENERAL_CONTINENT_INDEX)
+
+    # Definición del set de datos filtrando por continente elegido y agrupando
+    # por año.
+    df_graph_1 = af.population_by_year(continent_name)
 
     # Filtrado del set de datos por tipo de población elegida.
     if column_name != 'Todas':
@@ -156,35 +134,21 @@ elif selected == 'Situación general':
 
     # Para filtrar por continente de origen.
     with row3_2:
-        origin_continent = af.continent_selectbox(value=2, suffix='de origen')
+        origin_continent = af.continent_selectbox(value=2, suffix='de origen',
+                                                  index=af.PETITIONS_ORIGIN_INDEX)
 
     # Para filtrar por continente de asilo.
     with row3_3:
-        asylum_continent = af.continent_selectbox(exclude_continents=['Apátrida',
-                                                                      'Desconocido'],
-                                                  value=3,
-                                                  suffix='de asilo')
-
-    # Filtrado del set de datos por continente de origen elegido.
-    if origin_continent != 'Todos':
-        df_graph_2 = asylum_petitions.loc[asylum_petitions.continent_origin_country ==
-                                          origin_continent].groupby(['year',
-                                                                     'continent_asylum_country'],
-                                                                    as_index=False).sum()
-    else:
-        df_graph_2 = asylum_petitions.groupby(['year',
-                                               'continent_asylum_country'],
-                                              as_index=False).sum()
-
-    # Filtrado del set de datos por continente de asilo elegido.
-    if asylum_continent != 'Todos':
-        df_graph_2 = df_graph_2.loc[df_graph_2.continent_asylum_country ==
-                                    asylum_continent].groupby(['year'],
-                                                              as_index=False).sum()
+        asylum_continent = af.continent_selectbox(
+            exclude_continents=af.PETITIONS_ASYLUM_EXCLUDED_CONTINENTS,
+            value=3,
+            suffix='de asilo',
+            index=af.PETITIONS_ASYLUM_INDEX)
 
-    # Filtrado del set de datos por selección de columnas.
-    df_graph_2 = df_graph_2.loc[:, columns_names +
-                                ['year']].groupby(['year'], as_index=False).sum()
+    # Filtrado del set de datos por continentes de origen y asilo, y por
+    # selección de columnas.
+    df_graph_2 = af.petitions_by_year(origin_continent, asylum_continent,
+                                      columns_names)
 
     # Llamo la función para dibujar el gráfico
     af.plot_petitions_time(df_graph_2, columns_names)
@@ -195,89 +159,59 @@ elif selected == 'Situación general':
 # ================================
 else:
     st.header('Situación de los refugiados por país')
+    af.wait_for_warmup('country')
+
+    # Set de datos de países.
+    countries = af.load_dataset('countries')
 
     with st.expander('Selecciona algo diferente'):
         row4_1, row4_2 = st.columns((2, 3))
         with row4_1:
             # Para filtrar por continente.
-            continent_election = af.continent_selectbox(exclude_continents=['Apátrida',
-                                                                            'Desconocido',
-                                                                            'Todos'], index=2)
+            continent_election = af.continent_selectbox(
+                exclude_continents=af.COUNTRY_EXCLUDED_CONTINENTS,
+                index=af.COUNTRY_CONTINENT_INDEX)
             # Para filtrar por país.
             country = af.country_selectbox(countries, continent_election,
                                            variable='name')
 
         with row4_2:
             # Para filtrar por año.
-            year = st.selectbox('**Año**', range(1951, 2023), index=70)
+            year = st.selectbox('**Año**', af.COUNTRY_YEARS,
+                                index=af.COUNTRY_YEAR_INDEX)
 
             # Para filtrar datos de refugiados recibidos o enviados.
             situation = st.radio('**Refugiados**', ('Recibidos', 'Enviados'))
 
     st.subheader(f'{country}')
 
+    # Defino los sets de datos.
+    df_country, df_country_sex, _ = af.country_data(country, year, situation)
+    columns_names = af.situation_2_columns[situation]
+
     # Pantalla a mostrar si la opción elegida es ver los refugiados que recibe el país.
     if situation == 'Recibidos':
         description = f'''
                  **Las personas de los siguientes países se localizaron en
                  {country} en el año {year}.**'''
 
-        # Defino los sets de datos.
-        df_country = population.loc[(population.name_asylum_country == country) &
-                                    (population.year == year)].groupby(['year'],
-                                                                       as_index=False).sum()
-
-        df_country_sex = demographics.loc[(demographics.name_asylum_country == country) &
-                                          (demographics.year == year)].groupby(['year'],
-                                                                               as_index=False).sum()
-
-        df_map_3 = population.loc[(population.name_asylum_country == country) &
-                                  (population.year == year)]
-        df_map_3 = df_map_3[['longitude_origin_country', 'latitude_origin_country']]
-        df_map_3 = df_map_3.dropna()
-        df_map_3 = df_map_3.rename(columns={'longitude_origin_country': 'longitude',
-                                            'latitude_origin_country': 'latitude'})
-
         # Defino otra serie de variables necesarias para poder pintar las métricas.
         if df_country.empty:
             value = 0
         else:
-            value = df_country.loc[0, ['refugees', 'asylum_seekers', 'other_concern',
-                                       'other_need']].sum()
-
-        columns_names = ['refugees', 'asylum_seekers', 'other_concern',
-                         'other_need']
+            value = df_country.loc[0, columns_names].sum()
 
     # Pantalla a mostrar si la opción elegida es ver los refugiados que recibe el país.
     else:
         description = f'''
                  **Las personas de {country} se localizaron en los siguientes
                  países en el año {year}.**'''
-        # Defino los sets de datos.
-        df_country = population.loc[(population.name_origin_country == country) &
-                                    (population.year == year)].groupby(['year'],
-                                                                       as_index=False).sum()
-
-        df_country_sex = demographics.loc[(demographics.name_origin_country == country) &
-                                          (demographics.year == year)].groupby(['year'],
-                                                                               as_index=False).sum()
-
-        df_map_3 = population.loc[(population.name_origin_country == country) &
-                                  (population.year == year)]
-        df_map_3 = df_map_3[['longitude_asylum_country', 'latitude_asylum_country']]
-        df_map_3 = df_map_3.dropna()
-        df_map_3 = df_map_3.rename(columns={'longitude_asylum_country': 'longitude',
-                                            'latitude_asylum_country': 'latitude'})
 
         # Defino otra serie de variables necesarias para poder pintar las métricas
         value = df_country['refugees'] + df_country['asylum_seekers']\
             + df_country['internally_displaced'] + df_country['other_concern']\
             + df_country['other_need'] + df_country['returned_internally_displaced']
 
-        columns_names = ['refugees', 'asylum_seekers', 'other_concern',
-                         'internally_displaced', 'other_need',
-                         'returned_internally_displaced']
-
     # Estructura de ambas pantallas.
     st.write(description)
 
@@ -307,13 +241,11 @@ else:
     # Gráfico cantidad y tipo de población.
     with row6_1:
         # Defino el set de datos para dibujar el gráfico.
-        df_graph_3 = pd.melt(df_country, id_vars='year',
-                             value_vars=columns_names)
-        df_graph_3 = df_graph_3.loc[(df_graph_3.value != 0)]
+        df_graph_3 = af.population_by_type(country, year, situation)
 
         # Llamo a la función para dibujar el gráfico.
         if not df_graph_3.empty:
-            af.plot_population(df_graph_3)
+            af.plot_population(country, year, situation)
             st.caption('Fuente: Elaboración propia con datos extraídos de ACNUR.')
         else:
             st.write('**No hay datos para mostrar**')
@@ -322,5 +254,5 @@ else:
     with row6_2:
         # Llamo a la función para dibujar el mapa.
         if not df_graph_3.empty:
-            af.map_refugee(df_map_3)
+            af.map_refugee(country, year, situation)
             st.caption('Fuente: Elaboración propia con datos extraídos de ACNUR.')